@@ -2,13 +2,28 @@
 Tic Tac Toe Player
 """
 
-import copy
+import functools
 import math
 
 X = "X"
 O = "O"
 EMPTY = None
 
+# Bitboard used by the search: bit k of a mask is cell (k // 3, k % 3),
+# a position is the pair (x_mask, o_mask).
+FULL = 0b111111111
+LINES = [
+    0b000000111, 0b000111000, 0b111000000,  # rows
+    0b001001001, 0b010010010, 0b100100100,  # columns
+    0b100010001, 0b001010100,               # diagonals
+]
+# The same eight lines as (i, j) cells of a list board
+LINE_CELLS = [
+    ((0, 0), (0, 1), (0, 2)), ((1, 0), (1, 1), (1, 2)), ((2, 0), (2, 1), (2, 2)),
+    ((0, 0), (1, 0), (2, 0)), ((0, 1), (1, 1), (2, 1)), ((0, 2), (1, 2), (2, 2)),
+    ((0, 0), (1, 1), (2, 2)), ((0, 2), (1, 1), (2, 0)),
+]
+
 
 def initial_state():
     """
@@ -40,12 +55,12 @@ def actions(board):
     """
     Returns set of all possible actions (i, j) available on the board.
     """
-    ast = []
-    for i in range(len(board)):
-        for j in range(len(board[i])):
-            if board[i][j] == EMPTY:
-                ast.append((i, j))
-    return set(ast)
+    return {
+        (i, j)
+        for i, row in enumerate(board)
+        for j, cell in enumerate(row)
+        if cell is EMPTY
+    }
 
 
 
@@ -54,15 +69,13 @@ def result(board, action):
     """
     Returns the board that results from making move (i, j) on the board.
     """
-    if action not in actions(board):
-        raise ValueError("The action is empty")
-    x, y = action[0], action[1]
-    if board[x][y] == EMPTY:
-        tmp = copy.deepcopy(board)  # 不能再原地修改
-        tmp[x][y] = player(board)
-        return tmp
-    else:
+    x, y = action
+    if not (0 <= x < 3 and 0 <= y < 3) or board[x][y] is not EMPTY:
         raise ValueError("Invalid block")
+    # 不能再原地修改: copy only the changed row, the others are shared
+    new_row = list(board[x])
+    new_row[y] = player(board)
+    return [new_row if i == x else row for i, row in enumerate(board)]
 
 
 
@@ -70,20 +83,10 @@ def winner(board):
     """
     Returns the winner of the game, if there is one.
     """
-    # board not has all empty or board is ended in a tie
-    # row win
-    for r in range(len(board)):
-        if board[r][0] == board[r][1] == board[r][2]:
-            return board[r][0]
-    # column win
-    for c in range(len(board)):
-        if board[0][c] == board[1][c] == board[2][c]:
-            return board[0][c]
-    # diagonally win
-    if board[0][0] == board[1][1] and board[1][1] == board[2][2]:
-        return board[1][1]
-    elif board[0][2] == board[1][1] and board[1][1] == board[2][0]:
-        return board[1][1]
+    for a, b, c in LINE_CELLS:
+        v = board[a[0]][a[1]]
+        if v is not EMPTY and v == board[b[0]][b[1]] == board[c[0]][c[1]]:
+            return v
     return None
 
 def terminal(board):
@@ -116,69 +119,99 @@ def minimax(board):
     """
     if terminal(board):
         return None
-    p = player(board)
-    actset = actions(board)
-    val = []
-    if p == X:
-        for action in actset:
-            val.append(minimax_O(result(board, action)))
-        return list(actset)[max_X_index(val)]
-    elif p == O:
-        for action in actset:
-            val.append(minimax_X(result(board, action)))
-        return list(actset)[min_O_index(val)]
+    x, o = encode(board)
+    color = 1 if _player(x, o) == X else -1
+    # utility is bounded to [-1, 1], so a move worth 1 can not be beaten
+    alpha, beta = -1, 1
+    best = None
+    for k in _actions(x, o):
+        v = -negamax(*_result(x, o, k, color), -beta, -alpha, -color)
+        if best is None or v > alpha:
+            alpha, best = v, k
+        if alpha >= beta:
+            break
+    return divmod(best, 3)
+
+
+def encode(board):
+    """
+    Returns the (x_mask, o_mask) bitboard of the board.
+    """
+    x, o = 0, 0
+    for i in range(3):
+        for j in range(3):
+            if board[i][j] == X:
+                x |= 1 << (3 * i + j)
+            elif board[i][j] == O:
+                o |= 1 << (3 * i + j)
+    return x, o
+
+
+def _player(x, o):
+    return X if x.bit_count() == o.bit_count() else O
+
+
+def _actions(x, o):
+    empty = ~(x | o) & FULL
+    return [k for k in range(9) if empty >> k & 1]
+
+
+def _result(x, o, k, color):
+    # color is the mover (1 is X, -1 is O), known from the recursion depth
+    if color == 1:
+        return x | 1 << k, o
+    return x, o | 1 << k
+
+
+def _winner(x, o):
+    for m in LINES:
+        if x & m == m:
+            return X
+        if o & m == m:
+            return O
+    return None
+
+
+def _utility(x, o):
+    win = _winner(x, o)
+    if win == X:
+        return 1
+    elif win == O:
+        return -1
+    return 0
 
 
 '''
-1. 值的用处是分辨谁的步骤，如 val == 1， 则 X 在走
-2. 最后要比较的是在 game over 时，minimax_X有1说明X可以赢，反之minimax_O有-1说明O可以赢
-3. X & O 之间是“反抗的”，X 需要知道到达O的 Min valid 然后禁止O走，反之。
-
-if:
-1.                                      MAX: 1; p: X
-2.                 MIN: -1; p: O              or           MIN: 0; p: O              or  ... (actions)
-3.          MAX: 0; p: X or MAX: -1; p: X            MAX: 1; p: X or MAX: 0; p: X    or  ... (actions)
+1. color 的用处是分辨谁在走，如 color == 1，则 X 在走；color == -1，则 O 在走
+2. negamax 返回的是“走棋的人”看到的值：game over 时返回 color * utility，
+   所以不管谁走，1 都说明走棋的人可以赢，-1 说明他会输
+3. X & O 之间是“反抗的”，对手的值取负就是自己的值：
+   value = max(-negamax(child, -color))，所以不用分 minimax_X / minimax_O
+
+if: (X 在走, color == 1)
+1.                                      MAX: 1; color: 1
+2.                 -1; color: -1               or           0; color: -1             or  ... (actions)
+3.           1; color: 1 or 1; color: 1                  0; color: 1 or 1; color: 1    or  ... (actions)
 '''
 
 
-def minimax_X(board):
-    '''
-    get max valid to X for actions
+@functools.lru_cache(maxsize=None)
+def negamax(x, o, alpha, beta, color):
     '''
-    if terminal(board):
-        return utility(board)
-    max_v = -16
-    for action in actions(board):
-        max_v = max(max_v, minimax_O(result(board, action)))
-    return max_v
+    get valid of the position for the player to move (color 1 is X, -1 is O),
+    stop searching once a move reaches beta (alpha-beta pruning)
 
-def minimax_O(board):
+    the masks are hashable, so every (position, window) is searched only once;
+    the window is part of the key because a cut-off value depends on it
     '''
-    get max valid to X for actions
-    '''
-    if terminal(board):
-        return utility(board)
-    min_v = 16
-    for action in actions(board):
-        min_v = min(min_v, minimax_X(result(board, action)))
-    return min_v
-
-
-def max_X_index(v):
-    ix = 0
-    maxV = v[0]
-    for i,x in enumerate(v):
-        if x > maxV:
-            ix, maxV = i, x
-    return ix
-
-def min_O_index(v):
-    ix = 0
-    minV = v[0]
-    for i,x in enumerate(v):
-        if x < minV:
-            ix, minV = i, x
-    return ix
+    v = _utility(x, o)
+    if v != 0 or x | o == FULL:
+        return color * v
+    for k in _actions(x, o):
+        alpha = max(alpha, -negamax(*_result(x, o, k, color), -beta, -alpha, -color))
+        if alpha >= beta:
+            break
+    return alpha
 
 
 
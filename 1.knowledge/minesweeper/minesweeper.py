@@ -1,5 +1,14 @@
 import itertools
 import random
+from collections import deque
+
+# Offsets of the eight cells around a cell
+NEIGHBORS = [
+    (dr, dc)
+    for dr in (-1, 0, 1)
+    for dc in (-1, 0, 1)
+    if (dr, dc) != (0, 0)
+]
 
 
 class Minesweeper():
@@ -14,21 +23,15 @@ class Minesweeper():
         self.width = width
         self.mines = set()
 
-        # Initialize an empty field with no mines
-        self.board = []
-        for i in range(self.height):
-            row = []
-            for j in range(self.width):
-                row.append(False)
-            self.board.append(row)
+        # Initialize an empty field with no mines,
+        # cell (i, j) is self.board[i * width + j]
+        self.board = bytearray(height * width)
 
         # Add mines randomly
-        while len(self.mines) != mines:
-            i = random.randrange(height)
-            j = random.randrange(width)
-            if not self.board[i][j]:
-                self.mines.add((i, j))
-                self.board[i][j] = True
+        for k in random.sample(range(height * width), mines):
+            i, j = divmod(k, width)
+            self.mines.add((i, j))
+            self.board[k] = True
 
         # At first, player has found no mines
         self.mines_found = set()
@@ -41,7 +44,7 @@ class Minesweeper():
         for i in range(self.height):
             print("--" * self.width + "-")
             for j in range(self.width):
-                if self.board[i][j]:
+                if self.board[i * self.width + j]:
                     print("|X", end="")
                 else:
                     print("| ", end="")
@@ -50,7 +53,7 @@ class Minesweeper():
 
     def is_mine(self, cell):
         i, j = cell
-        return self.board[i][j]
+        return bool(self.board[i * self.width + j])
 
     def nearby_mines(self, cell):
         """
@@ -63,17 +66,13 @@ class Minesweeper():
         count = 0
 
         # Loop over all cells within one row and column
-        for i in range(cell[0] - 1, cell[0] + 2):
-            for j in range(cell[1] - 1, cell[1] + 2):
+        for dr, dc in NEIGHBORS:
+            i, j = cell[0] + dr, cell[1] + dc
 
-                # Ignore the cell itself
-                if (i, j) == cell:
-                    continue
-
-                # Update count if cell in bounds and is mine
-                if 0 <= i < self.height and 0 <= j < self.width:
-                    if self.board[i][j]:
-                        count += 1
+            # Update count if cell in bounds and is mine
+            if 0 <= i < self.height and 0 <= j < self.width:
+                if self.board[i * self.width + j]:
+                    count += 1
 
         return count
 
@@ -91,23 +90,46 @@ class Sentence():
     and a count of the number of those cells which are mines.
     """
 
+    UNKNOWN = 0
+    ALL_MINE = 1
+    ALL_SAFE = 2
+
     def __init__(self, cells, count):
         self.cells = set(cells)
         self.count = count
+        self._update_status()
 
     def __eq__(self, other):
         return self.cells == other.cells and self.count == other.count
 
+    def __hash__(self):
+        return hash((frozenset(self.cells), self.count))
+
     def __str__(self):
         return f"{self.cells} = {self.count}"
 
+    def _update_status(self):
+        # recomputed only when cells or count change
+        if self.count == 0:
+            self._status = Sentence.ALL_SAFE
+        # The numbers cells is equal to the count,
+        # we know that all of that sentence’s cells must be mines.
+        elif len(self.cells) == self.count:
+            self._status = Sentence.ALL_MINE
+        else:
+            self._status = Sentence.UNKNOWN
+
+    def is_all_mine(self):
+        return self._status == Sentence.ALL_MINE
+
+    def is_all_safe(self):
+        return self._status == Sentence.ALL_SAFE
+
     def known_mines(self):
         """
         Returns the set of all cells in self.cells known to be mines.
         """
-        # The numbers cells is equal to the count,
-        # we know that all of that sentence’s cells must be mines.
-        if len(self.cells) == self.count and self.count != 0:
+        if self._status == Sentence.ALL_MINE:
             return self.cells
         else:
             return set()
@@ -117,7 +139,7 @@ class Sentence():
         """
         Returns the set of all cells in self.cells known to be safe.
         """
-        if self.count == 0:
+        if self._status == Sentence.ALL_SAFE:
             return self.cells
         else:
             return set()
@@ -128,9 +150,13 @@ class Sentence():
         a cell is known to be a mine.
         """
         # if cell is mine and in cells, cells update and count sub 1
+        # return True if the sentence changed
         if cell in self.cells:
             self.cells.discard(cell)
             self.count -= 1
+            self._update_status()
+            return True
+        return False
 
 
 
@@ -142,6 +168,9 @@ class Sentence():
         """
         if cell in self.cells:
             self.cells.discard(cell)
+            self._update_status()
+            return True
+        return False
 
 
 class MinesweeperAI():
@@ -157,13 +186,19 @@ class MinesweeperAI():
 
         # Keep track of which cells have been clicked on
         self.moves_made = set()
+        # Cells neither clicked on nor known to be mines
+        self._unclicked = {(i, j) for i in range(height) for j in range(width)}
 
         # Keep track of cells known to be safe or mines
         self.mines = set()
         self.safes = set()
+        # Known safes that have not been clicked on yet
+        self._available_safes = set()
 
         # List of sentences about the game known to be true
         self.knowledge = []
+        # (cells, count) of every sentence ever added, to skip duplicates
+        self._seen = set()
 
     def mark_mine(self, cell):
         """
@@ -171,8 +206,9 @@ class MinesweeperAI():
         to mark that cell as a mine as well.
         """
         self.mines.add(cell)
-        for sentence in self.knowledge:
-            sentence.mark_mine(cell)
+        self._unclicked.discard(cell)
+        self._available_safes.discard(cell)
+        return [s for s in self.knowledge if s.mark_mine(cell)]
 
 
     def mark_safe(self, cell):
@@ -181,8 +217,9 @@ class MinesweeperAI():
         to mark that cell as safe as well.
         """
         self.safes.add(cell)
-        for sentence in self.knowledge:
-            sentence.mark_safe(cell)
+        if cell not in self.mines and cell not in self.moves_made:
+            self._available_safes.add(cell)
+        return [s for s in self.knowledge if s.mark_safe(cell)]
 
     def add_knowledge(self, cell, count):
         """
@@ -247,7 +284,11 @@ class MinesweeperAI():
     def state(self, cell):
         try:
             # clicked a cell / move cell
+            # (a clicked cell is no longer an unplayed safe, and mark_safe
+            # below does not add it back since it is in moves_made)
             self.moves_made.add(cell)
+            self._unclicked.discard(cell)
+            self._available_safes.discard(cell)
             # mark the cell as safe.
             self.mark_safe(cell)
         except EOFError as e:
@@ -258,7 +299,7 @@ class MinesweeperAI():
         mine_cell, count_mines = self.cell_neighbors(cell)
         subSentence = Sentence(mine_cell, count - count_mines)
         # updating any sentences that contain the cell as well.
-        self.knowledge.append(subSentence)
+        self.add_sentence(subSentence)
         '''
             KB = [
                 {D, G} = 1,
@@ -276,20 +317,34 @@ class MinesweeperAI():
 
     def mark_safe_or_mine(self):
         # update knowledge base
-        # update all cell of sentences
-        knowledge_flag = True
-        while knowledge_flag:
-            knowledge_flag = False
-            for sentence in self.knowledge:
-                if sentence.known_mines():
-                    # RuntimeError: Set changed size during iteration so set copy
-                    for cell in sentence.known_mines().copy():
-                        self.mark_mine(cell)
-                        knowledge_flag = True
-                if sentence.known_safes():
-                    for cell in sentence.known_safes().copy():
-                        self.mark_safe(cell)
-                        knowledge_flag = True
+        # worklist: cells concluded to be mines or safes, only the sentences
+        # changed by marking a cell are checked again for new conclusions
+        pending_mines, pending_safes = deque(), deque()
+        for sentence in self.knowledge:
+            if sentence.is_all_mine():
+                pending_mines.extend(sentence.cells)
+            elif sentence.is_all_safe():
+                pending_safes.extend(sentence.cells)
+
+        while pending_mines or pending_safes:
+            if pending_mines:
+                cell = pending_mines.popleft()
+                if cell in self.mines:
+                    continue
+                changed = self.mark_mine(cell)
+            else:
+                cell = pending_safes.popleft()
+                if cell in self.safes:
+                    continue
+                changed = self.mark_safe(cell)
+            for sentence in changed:
+                if sentence.is_all_mine():
+                    pending_mines.extend(sentence.cells)
+                elif sentence.is_all_safe():
+                    pending_safes.extend(sentence.cells)
+
+        # sentences without cells say nothing any more
+        self.knowledge = [s for s in self.knowledge if s.cells]
 
 
     def new_inference(self, subset):
@@ -301,23 +356,29 @@ class MinesweeperAI():
                 # set2-set1 = count2 - count1
                 newSubset = sentence.cells.difference(subset.cells)
                 newSentence = Sentence(set(newSubset), sentence.count - subset.count)
-                self.knowledge.append(newSentence)
+                self.add_sentence(newSentence)
+
+    def add_sentence(self, sentence):
+        # skip empty sentences and sentences already in the knowledge base
+        key = (frozenset(sentence.cells), sentence.count)
+        if not sentence.cells or key in self._seen:
+            return
+        self._seen.add(key)
+        self.knowledge.append(sentence)
 
 
 
     def cell_neighbors(self, cell):
         tmp = set()
         count_mines = 0
-        for r in range(cell[0] - 1, cell[0] + 2):
-            for c in range(cell[1] - 1, cell[1] + 2):
-                if (0 <= r < self.height and 0 <= c < self.width) \
-                    and ((r, c) not in self.safes) \
-                    and ((r, c) not in self.mines) \
-                    and ((r, c) not in self.moves_made) \
-                    and ((r, c) != (cell[0], cell[1])):
-                    tmp.add((r, c))
-                if (r, c) in self.mines:
-                    count_mines += 1
+        for dr, dc in NEIGHBORS:
+            r, c = cell[0] + dr, cell[1] + dc
+            if (r, c) in self.mines:
+                count_mines += 1
+            elif (0 <= r < self.height and 0 <= c < self.width) \
+                and ((r, c) not in self.safes) \
+                and ((r, c) not in self.moves_made):
+                tmp.add((r, c))
         return tmp, count_mines
 
 
@@ -330,10 +391,7 @@ class MinesweeperAI():
         This function may use the knowledge in self.mines, self.safes
         and self.moves_made, but should not modify any of those values.
         """
-        for move_cell in self.safes:
-            if move_cell not in self.mines and move_cell not in self.moves_made:
-                return move_cell
-        return None
+        return next(iter(self._available_safes), None)
 
     def make_random_move(self):
         """
@@ -342,12 +400,7 @@ class MinesweeperAI():
             1) have not already been chosen, and
             2) are not known to be mines
         """
-        random_move = []
-        for i in range(self.height):
-            for j in range(self.width):
-                if (i, j) not in self.mines and (i, j) not in self.moves_made:
-                    random_move.append((i, j))
-        if len(random_move) != 0:
-            return random.choice(random_move)
+        if self._unclicked:
+            return random.choice(list(self._unclicked))
         else:
             return None
@@ -1,3 +1,5 @@
+import mmap
+import operator
 import os
 import random
 import re
@@ -5,6 +7,7 @@ import sys
 
 DAMPING = 0.85
 SAMPLES = 10000
+LINK_RE = re.compile(rb"<a\s+(?:[^>]*?)href=\"([^\"]*)\"")
 
 
 def main():
@@ -33,10 +36,14 @@ def crawl(directory):
     for filename in os.listdir(directory):
         if not filename.endswith(".html"):
             continue
-        with open(os.path.join(directory, filename)) as f:
-            contents = f.read()
-            links = re.findall(r"<a\s+(?:[^>]*?)href=\"([^\"]*)\"", contents)
-            pages[filename] = set(links) - {filename}
+        with open(os.path.join(directory, filename), "rb") as f:
+            # an empty file cannot be mapped, and has no links anyway
+            if os.fstat(f.fileno()).st_size == 0:
+                links = []
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+                    links = LINK_RE.findall(contents)
+            pages[filename] = set(link.decode() for link in links) - {filename}
 
     # Only include links to other pages in the corpus
     for filename in pages:
@@ -60,27 +67,23 @@ def transition_model(corpus, page, damping_factor):
     if page not in corpus:
         raise ValueError("Page not in corpus")
     else:
-        page_dict = {}
         page_link = corpus[page]
         num_links = len(page_link)
         num_page = len(corpus)
 
-
+        # fill every page with the teleport share in one go, then add the
+        # link share to the linked pages only
         if num_links == 0:
-            for p in corpus.keys():
-                page_dict[p] = 1 / num_page
+            page_dict = dict.fromkeys(corpus, 1 / num_page)
         else:
             p_href = damping_factor / num_links
             p_all_page = (1 - damping_factor) / num_page
-            for p in corpus:
-                if p in page_link:
-                    page_dict[p] = p_href + p_all_page
-                else:
-                    page_dict[p] = p_all_page
-
-    # 减小误差
-    if abs(1-sum(page_dict.values())) > 0.0001:
-        raise ValueError("Sum of PR_dict is not 1")
+            page_dict = dict.fromkeys(corpus, p_all_page)
+            for p in page_link:
+                page_dict[p] += p_href
+
+    # 减小误差; the sum is 1 by construction, so only check it in debug runs
+    assert abs(1 - sum(page_dict.values())) <= 0.0001, "Sum of PR_dict is not 1"
     return page_dict
 
 
@@ -97,28 +100,66 @@ def sample_pagerank(corpus, damping_factor, n):
     """
     # 为每个页面初始化 samples value
     page_range = {page: 0 for page in corpus.keys()}
-    # num_page = len(corpus)
+    pages = list(corpus.keys())
+    # The transition model is a mixture: with probability `damping_factor`
+    # follow one of the page's links, otherwise (or when there are none)
+    # jump to any page. Sampling the mixture directly is the same
+    # distribution without building it for every step.
+    links = {page: tuple(corpus[page]) for page in pages}
+
     # 随机选择一个页面
-    curr_page = random.choice(list(corpus.keys()))
+    curr_page = random.choice(pages)
     page_range[curr_page] += 1
 
     for _ in range(1, n):
         # 通过转移模型选择下一个页面
-        next_page = transition_model(corpus, curr_page, damping_factor)
+        if links[curr_page] and random.random() < damping_factor:
+            curr_page = random.choice(links[curr_page])
         # 没有链接的页面，随机选择下一个页面
-        if next_page == {}:
-            next_page = random.choice(list(corpus.keys()))
         else:
-            next_page = random.choices(list(next_page.keys()), weights=list(next_page.values()), k=1)[0]
-
-        page_range[next_page] += 1
-        curr_page = next_page
+            curr_page = random.choice(pages)
+        page_range[curr_page] += 1
     # calculate the PR
     for page in page_range:
         page_range[page] /= n
     return page_range
 
 
+def link_graph(corpus):
+    """
+    Return the corpus as index lists: the pages in a fixed order, the
+    number of links on each page, and the pages linking *to* each page in
+    compressed sparse row form, i.e. `in_indices[in_indptr[i]:in_indptr[i + 1]]`
+    are the indices of the pages that link to page `i`.
+    """
+    pages = list(corpus)
+    index = {page: i for i, page in enumerate(pages)}
+    outdegree = [len(corpus[page]) for page in pages]
+
+    incoming = [[] for _ in pages]
+    for p, page in enumerate(pages):
+        for link in corpus[page]:
+            incoming[index[link]].append(p)
+
+    in_indptr = [0]
+    in_indices = []
+    for links in incoming:
+        in_indices.extend(links)
+        in_indptr.append(len(in_indices))
+    return pages, outdegree, in_indptr, in_indices
+
+
+def matvec(indptr, indices, data, vector):
+    """
+    Return the product of the sparse CSR matrix `(indptr, indices, data)`
+    with `vector`.
+    """
+    get = vector.__getitem__
+    return [
+        sum(map(operator.mul, data[start:end], map(get, indices[start:end])))
+        for start, end in zip(indptr, indptr[1:])
+    ]
+
 
 def iterate_pagerank(corpus, damping_factor):
     """
@@ -129,58 +170,32 @@ def iterate_pagerank(corpus, damping_factor):
     their estimated PageRank value (a value between 0 and 1). All
     PageRank values should sum to 1.
     """
+    pages, outdegree, in_indptr, in_indices = link_graph(corpus)
+    num_pages = len(pages)
+    # 没有出链接的页面，假设它们链接到所有页面
+    dangling = [p for p in range(num_pages) if not outdegree[p]]
 
-    # num_pages = len(corpus)
-    # PR_dict = dict()
-    # # 初始化PR
-    # for page in corpus.keys():
-    #     PR_dict[page] = 1 / num_pages
-    # # 重复计算直到不超过.001
-    # while True:
-    #     PR_dict_copy = PR_dict.copy()
-    #     for page_i in PR_dict:
-    #         PR_dict[page_i] = (1 - damping_factor) / num_pages
-    #         for page_p in corpus:
-    #             # 如果页面p链接到页面i
-    #             if page_i in corpus[page_p]:
-    #                 PR_dict[page_i] += damping_factor * PR_dict_copy[page_p] / len(corpus[page_p])
-    #     # 如果PR_dict和PR_dict_copy的差异小于0.001，停止迭代
-    #     if all(abs(PR_dict[page] - PR_dict_copy[page]) < 0.001 for page in PR_dict):
-    #         break
-    # return PR_dict
-    num_pages = len(corpus)
-    PR_dict = {page: 1 / num_pages for page in corpus}
-
-    # 处理没有出链接的页面，假设它们链接到所有页面
-    for page in corpus:
-        if not corpus[page]:
-            corpus[page] = set(corpus.keys())
+    # M[i, p] = 1 / outdegree(p) for every link p -> i
+    weights = [1 / outdegree[p] for p in in_indices]
 
+    ranks = [1 / num_pages] * num_pages
     while True:
-        PR_dict_copy = PR_dict.copy()
-        change = False  # 用于检查是否有任何PageRank值的变化超过了0.001
-        for page_i in PR_dict:
-            rank_sum = 0
-            for page_p in corpus:
-                if page_i in corpus[page_p]:
-                    rank_sum += PR_dict_copy[page_p] / len(corpus[page_p])
-            new_rank = (1 - damping_factor) / num_pages + (damping_factor * rank_sum)
-
-            # 检查变化是否超过0.001
-            if abs(new_rank - PR_dict[page_i]) > 0.001:
-                change = True
-            PR_dict[page_i] = new_rank
+        teleport = (1 - damping_factor) / num_pages \
+            + damping_factor * sum(ranks[p] for p in dangling) / num_pages
+        new_ranks = [
+            teleport + damping_factor * rank
+            for rank in matvec(in_indptr, in_indices, weights, ranks)
+        ]
 
         # 如果没有任何变化超过0.001，停止迭代
-        if not change:
+        done = max(
+            abs(new - old) for new, old in zip(new_ranks, ranks)
+        ) <= 0.001
+        ranks = new_ranks
+        if done:
             break
 
-    # 正规化PageRank值以确保它们的总和为1
-    total_rank = sum(PR_dict.values())
-    for page in PR_dict:
-        PR_dict[page] /= total_rank
-
-    return PR_dict
+    return dict(zip(pages, ranks))
 
 
 if __name__ == "__main__":
@@ -1,7 +1,38 @@
+import heapq
 import sys
+from collections import Counter, deque
+from itertools import repeat
+from operator import itemgetter
 
 from crossword import *
 
+# Pillow is only needed by save, so it is imported on first use
+_PIL = None
+_FONT_CACHE = dict()
+
+
+def _get_pil():
+    """
+    Return the (Image, ImageDraw, ImageFont) modules, importing them once.
+    """
+    global _PIL
+    if _PIL is None:
+        from PIL import Image, ImageDraw, ImageFont
+        _PIL = (Image, ImageDraw, ImageFont)
+    return _PIL
+
+
+def _get_font(size):
+    """
+    Return the grid font at `size` points, loading each size only once.
+    """
+    font = _FONT_CACHE.get(size)
+    if font is None:
+        _, _, ImageFont = _get_pil()
+        font = ImageFont.truetype("assets/fonts/OpenSans-Regular.ttf", size)
+        _FONT_CACHE[size] = font
+    return font
+
 
 class CrosswordCreator():
 
@@ -10,36 +41,93 @@ class CrosswordCreator():
         Create new CSP crossword generate.
         """
         self.crossword = crossword
+
+        # Group words by length, and index them by letter position:
+        # `self.letter_index[length][k][letter]` is the set of words of
+        # that length with `letter` at index k
+        self.words_by_len = dict()
+        for word in self.crossword.words:
+            self.words_by_len.setdefault(len(word), set()).add(word)
+
+        # Each domain starts with the words of the right length only,
+        # so the domains are node-consistent from the start
         self.domains = {
-            var: self.crossword.words.copy()
+            var: self.words_by_len.get(var.length, set()).copy()
             for var in self.crossword.variables
         }
 
-    def letter_grid(self, assignment):
+        lengths = set(self.words_by_len)
+        lengths.update(var.length for var in self.crossword.variables)
+        self.letter_index = dict()
+        for length in lengths:
+            index = [dict() for _ in range(length)]
+            for word in self.words_by_len.get(length, ()):
+                for k, letter in enumerate(word):
+                    index[k].setdefault(letter, set()).add(word)
+            self.letter_index[length] = index
+
+        # Stack of undo frames, one per inference made by `backtrack`;
+        # each frame lists the (var, removed words) pruned by `revise`
+        self.trail = []
+
+        # var -> (words, counts) letter counts of a domain (AC-4 style
+        # support) and a private copy of the words they were counted from,
+        # see `support`
+        self._support = dict()
+
+        # The crossword graph is static, so compute each neighbor set once
+        self._neighbors = {
+            var: frozenset(self.crossword.neighbors(var))
+            for var in self.crossword.variables
+        }
+        # Indexes of each variable that some neighbor overlaps
+        self._crossings = {
+            var: sorted({self.crossword.overlaps[n, var][1] for n in self._neighbors[var]})
+            for var in self.crossword.variables
+        }
+        # Every arc of the problem, for the first run of `ac3`; arcs with
+        # no overlapping cell can never revise anything and are left out
+        self._arcs = tuple(
+            (x, y)
+            for x, neighbors in self._neighbors.items()
+            for y in neighbors
+            if self.crossword.overlaps[x, y]
+        )
+        # Per-arc constants of `revise`: the letter index of x at the
+        # overlap, and the index of y at the overlap
+        self._arc_index = {
+            (x, y): (self.letter_index[x.length][self.crossword.overlaps[x, y][0]],
+                     self.crossword.overlaps[x, y][1])
+            for x, y in self._arcs
+        }
+        self.degree = {
+            var: len(self._neighbors[var]) for var in self.crossword.variables
+        }
+
+    def letter_buffer(self, assignment):
         """
-        Return 2D array representing a given assignment.
+        Return the letters of a given assignment as a flat list of
+        one-character strings: cell (i, j) is at index i * width + j,
+        empty cells are spaces.
         """
-        letters = [
-            [None for _ in range(self.crossword.width)]
-            for _ in range(self.crossword.height)
-        ]
+        width = self.crossword.width
+        letters = [" "] * (self.crossword.height * width)
         for variable, word in assignment.items():
-            direction = variable.direction
-            for k in range(len(word)):
-                i = variable.i + (k if direction == Variable.DOWN else 0)
-                j = variable.j + (k if direction == Variable.ACROSS else 0)
-                letters[i][j] = word[k]
+            step = width if variable.direction == Variable.DOWN else 1
+            start = variable.i * width + variable.j
+            letters[start:start + step * len(word):step] = word
         return letters
 
     def print(self, assignment):
         """
         Print crossword assignment to the terminal.
         """
-        letters = self.letter_grid(assignment)
+        letters = self.letter_buffer(assignment)
+        width = self.crossword.width
         for i in range(self.crossword.height):
-            for j in range(self.crossword.width):
+            for j in range(width):
                 if self.crossword.structure[i][j]:
-                    print(letters[i][j] or " ", end="")
+                    print(letters[i * width + j], end="")
                 else:
                     print("█", end="")
             print()
@@ -48,11 +136,12 @@ class CrosswordCreator():
         """
         Save crossword assignment to an image file.
         """
-        from PIL import Image, ImageDraw, ImageFont
+        Image, ImageDraw, _ = _get_pil()
         cell_size = 100
         cell_border = 2
         interior_size = cell_size - 2 * cell_border
-        letters = self.letter_grid(assignment)
+        letters = self.letter_buffer(assignment)
+        width = self.crossword.width
 
         # Create a blank canvas
         img = Image.new(
@@ -61,9 +150,15 @@ class CrosswordCreator():
              self.crossword.height * cell_size),
             "black"
         )
-        font = ImageFont.truetype("assets/fonts/OpenSans-Regular.ttf", 80)
+        font = _get_font(80)
         draw = ImageDraw.Draw(img)
 
+        # Measure each distinct letter once instead of once per cell
+        bbox_of = {
+            letter: draw.textbbox((0, 0), letter, font=font) # type: ignore
+            for letter in set("".join(assignment.values()))
+        }
+
         for i in range(self.crossword.height):
             for j in range(self.crossword.width):
 
@@ -75,12 +170,13 @@ class CrosswordCreator():
                 ]
                 if self.crossword.structure[i][j]:
                     draw.rectangle(rect, fill="white") # type: ignore
-                    if letters[i][j]:
-                        _, _, w, h = draw.textbbox((0, 0), letters[i][j], font=font) # type: ignore
+                    letter = letters[i * width + j]
+                    if letter != " ":
+                        _, _, w, h = bbox_of[letter]
                         draw.text(
                             (rect[0][0] + ((interior_size - w) / 2),
                              rect[0][1] + ((interior_size - h) / 2) - 10),
-                            letters[i][j], fill="black", font=font # type: ignore
+                            letter, fill="black", font=font # type: ignore
                         )
 
         img.save(filename)
@@ -89,10 +185,37 @@ class CrosswordCreator():
         """
         Enforce node and arc consistency, and then solve the CSP.
         """
-        self.enforce_node_consistency()
-        self.ac3()
+        # the domains are already node-consistent, see `__init__`
+        pruned = self.prune_by_buckets()
+        if pruned is None:
+            self.ac3()
+        else:
+            # every other arc was made consistent by the pruning pass
+            self.ac3([(z, y) for y in pruned for z in self._neighbors[y]])
         return self.backtrack(dict())
 
+    def prune_by_buckets(self):
+        """
+        Remove the words of each variable whose letter at an overlap is not
+        found at that cell in any word of the neighbor's length bucket.
+
+        This is the first round of AC-3 done straight from `letter_index`,
+        with one removal per variable. It is only valid while each domain
+        is still its whole length bucket: if one is not, nothing is pruned
+        and None is returned. Otherwise return the set of pruned variables.
+        """
+        for var in self.crossword.variables:
+            if self.domains[var] != self.words_by_len.get(var.length, set()):
+                return None
+        removed = dict()
+        for (x, y), (index_x, j) in self._arc_index.items():
+            letters_y = self.letter_index[y.length][j].keys()
+            for letter in index_x.keys() - letters_y:
+                removed.setdefault(x, set()).update(index_x[letter])
+        for var, words in removed.items():
+            self.remove_words(var, words)
+        return set(removed)
+
     def enforce_node_consistency(self):
         """
         Update `self.domains` such that each variable is node-consistent.
@@ -100,9 +223,10 @@ class CrosswordCreator():
          constraints; in this case, the length of the word.)
         """
         for var in self.crossword.variables:
-            for word in self.crossword.words:
-                if len(word) != var.length:
-                    self.domains[var].remove(word)
+            # keep only the words in the length bucket; a set difference
+            # rather than a copy of the bucket, so earlier pruning stays
+            bucket = self.words_by_len.get(var.length, set())
+            self.remove_words(var, self.domains[var] - bucket)
 
     def revise(self, x, y):
         """
@@ -114,22 +238,89 @@ class CrosswordCreator():
         False if no revision was made.
         """
         revised = False
-        overlap = self.crossword.overlaps[x, y]
-        words_remove = set()
+        arc_index = self._arc_index.get((x, y))
         # if there is an overlapping cell then check (x ?= y)
-        if overlap:
-            i, j = overlap
-            # checking x arc consistent with y
-            for word_x in self.domains[x].copy():
-                # only domain[y] has word, but domain[x] does not need to has this
-                # check letter
-                if not any(word_x[i] == word_y[j] for word_y in self.domains[y]):
+        if arc_index:
+            index_x, j = arc_index
+            support_y = self.support(y)[j]
+            # remove the words of x whose letter at i is not the letter at j
+            # of any word still in domain[y]
+            domain_x = self.domains[x]
+            words_remove = set()
+            for letter in index_x.keys() - support_y.keys():
+                words_remove |= domain_x & index_x[letter]
+            # words outside the wordlist's bucket for this length (a domain
+            # set by hand) are not in `letter_index`, so check them directly
+            i = self.crossword.overlaps[x, y][0]
+            for word_x in domain_x - self.words_by_len.get(x.length, set()):
+                if word_x[i] not in support_y:
                     words_remove.add(word_x)
             if words_remove:
-                self.domains[x] -= words_remove
+                if self.trail:
+                    self.trail[-1].append((x, words_remove))
+                self.remove_words(x, words_remove)
                 revised = True
         return revised
 
+    def support(self, var):
+        """
+        Return the letter counts of `self.domains[var]`: for each index k
+        of the variable that a neighbor overlaps, a Counter of the letters
+        its words have at k. Only letters with a count above 0 are keys.
+
+        Small changes made by `remove_words` and `add_words` update the
+        counts in place. The counts are only reused while the domain still
+        holds exactly the words they were counted from, so after a large
+        change, or if the domain was replaced or edited some other way,
+        they are counted again here.
+        """
+        domain = self.domains[var]
+        entry = self._support.get(var)
+        if entry is None or entry[0] != domain:
+            counts = {
+                k: Counter(map(itemgetter(k), domain))
+                for k in self._crossings[var]
+            }
+            entry = self._support[var] = (set(domain), counts)
+        return entry[1]
+
+    def remove_words(self, var, words):
+        """
+        Remove `words` from `self.domains[var]`, updating its letter counts.
+        """
+        domain = self.domains[var]
+        # only the words actually in the domain change its letter counts
+        words = domain & words
+        entry = self._support.get(var)
+        fresh = entry is not None and entry[0] == domain
+        domain -= words
+        if fresh and 4 * len(words) <= len(domain):
+            entry[0].difference_update(words)
+            for k, count in entry[1].items():
+                # letters whose count drops to 0 are removed from the Counter
+                count -= Counter(map(itemgetter(k), words))
+        else:
+            # cheaper to count the words left when `support` next needs them
+            self._support.pop(var, None)
+
+    def add_words(self, var, words):
+        """
+        Add `words` back to `self.domains[var]`, updating its letter counts.
+        """
+        domain = self.domains[var]
+        # only the words not yet in the domain change its letter counts
+        words = words - domain
+        entry = self._support.get(var)
+        fresh = entry is not None and entry[0] == domain
+        domain |= words
+        if fresh and 4 * len(words) <= len(domain):
+            entry[0].update(words)
+            for k, count in entry[1].items():
+                count.update(map(itemgetter(k), words))
+        else:
+            # cheaper to count the whole domain when `support` next needs it
+            self._support.pop(var, None)
+
     def ac3(self, arcs=None):
         """
         Update `self.domains` such that each variable is arc consistent.
@@ -140,18 +331,24 @@ class CrosswordCreator():
         return False if one or more domains end up empty.
         """
         # if arcs is None, begin with initial list of all arcs in the problem
-        if arcs is None:
-            arcs = ((x, y) for x in self.crossword.variables for y in self.crossword.neighbors(x))
-        csp_queue = list(arcs)
+        csp_queue = deque(self._arcs if arcs is None else arcs)
+        # arcs already waiting in the queue are not queued a second time
+        queued = set(csp_queue)
+        neighbors = self._neighbors
+        revise = self.revise
 
         while csp_queue:
-            x, y = csp_queue.pop(0)
-            if self.revise(x, y):
+            arc = csp_queue.popleft()
+            queued.discard(arc)
+            x, y = arc
+            if revise(x, y):
                 # if x.domain is empty, return False
                 if not self.domains[x]:
                     return False
-                for z in self.crossword.neighbors(x) - {y}:
-                    csp_queue.append((z, x))
+                for z in neighbors[x]:
+                    if z != y and (z, x) not in queued:
+                        queued.add((z, x))
+                        csp_queue.append((z, x))
         return True
 
     def assignment_complete(self, assignment):
@@ -172,7 +369,7 @@ class CrosswordCreator():
         for var_x, word_x in assignment.items():
             if var_x.length != len(word_x):
                 return False
-            for var_y in self.crossword.neighbors(var_x):
+            for var_y in self._neighbors[var_x]:
                 if var_y in assignment:
                     word_y = assignment[var_y]
                     i, j = self.crossword.overlaps[var_x, var_y]
@@ -180,6 +377,20 @@ class CrosswordCreator():
                         return False
         return True
 
+    def _consistent_add(self, assignment, var, value):
+        """
+        Return True if adding `var` = `value` to the consistent `assignment`
+        keeps it consistent; only the constraints of `var` are checked.
+        """
+        if var.length != len(value):
+            return False
+        for n in self._neighbors[var]:
+            if n in assignment:
+                i, j = self.crossword.overlaps[var, n]
+                if value[i] != assignment[n][j]:
+                    return False
+        return True
+
     def order_domain_values(self, var, assignment):
         """
         Return a list of values in the domain of `var`, in order by
@@ -187,20 +398,46 @@ class CrosswordCreator():
         The first value in the list, for example, should be the one
         that rules out the fewest values among the neighbors of `var`.
         """
-        value_heuristic = dict()
-        for word in self.domains[var]:
-            value_heuristic[word] = 0
-            # neighbors of var
-            for n in self.crossword.neighbors(var) - set(assignment):
-                (i, j) = self.crossword.overlaps[var, n]
-                if (i, j):
-                    for word_n in self.domains[n]:
-                        if word[i] != word_n[j]:
-                            value_heuristic[word] += 1
-
+        value_heuristic = self.value_heuristic(var, assignment)
         value_heuristic = sorted(value_heuristic.items(), key=lambda x: x[1])
         return [word for word, _ in value_heuristic]
 
+    def iter_domain_values(self, var, assignment):
+        """
+        Yield the values in the domain of `var` in the same order as
+        `order_domain_values`, but pop them from a heap one at a time,
+        so a search that succeeds early does not sort the whole domain.
+        """
+        heap = [(h, word) for word, h in self.value_heuristic(var, assignment).items()]
+        heapq.heapify(heap)
+        while heap:
+            yield heapq.heappop(heap)[1]
+
+    def value_heuristic(self, var, assignment):
+        """
+        Return a dict mapping each value in the domain of `var` to the
+        number of values it rules out for the unassigned neighbors of `var`.
+        """
+        # a word rules out the words of a neighbor with a different letter
+        # at the overlap; the neighbors are independent, so score each one
+        # over the whole domain with the cached letter counts of `support`,
+        # then add the columns up (every column walks the unchanged set in
+        # the same order, so it needs no list copy)
+        domain = self.domains[var]
+        total = 0
+        columns = []
+        for n in self._neighbors[var]:
+            if n in assignment:
+                continue
+            i, j = self.crossword.overlaps[var, n]
+            counts = self.support(n)[j]
+            total += len(self.domains[n])
+            columns.append(map(counts.get, map(itemgetter(i), domain), repeat(0)))
+
+        if not columns:
+            return dict.fromkeys(domain, 0)
+        return dict(zip(domain, [total - kept for kept in map(sum, zip(*columns))]))
+
     def select_unassigned_variable(self, assignment):
         """
         Return an unassigned variable not already part of `assignment`.
@@ -209,21 +446,15 @@ class CrosswordCreator():
         degree. If there is a tie, any of the tied variables are acceptable
         return values.
         """
-        unassigned_var = None
-        # 使用无穷大初始化
-        min_num_var = float('inf')
-        max_degree = -1
-
-        for var in self.crossword.variables - set(assignment):
-            # calculate the number of remaining value in domain
-            num_var = len(self.domains[var])
-            degree = len(self.crossword.neighbors(var))
-            #
-            if (num_var < min_num_var) or (num_var == min_num_var and degree > max_degree):
-                unassigned_var = var
-                min_num_var = num_var
-                max_degree = degree
-        return unassigned_var
+        # a plain scan: it always sees the current domains, however they
+        # were changed, and grids have few enough variables
+        domains = self.domains
+        unassigned = [
+            var for var in self.crossword.variables if var not in assignment
+        ]
+        if not unassigned:
+            return None
+        return min(unassigned, key=lambda var: (len(domains[var]), -self.degree[var]))
 
     def backtrack(self, assignment):
         """
@@ -240,21 +471,26 @@ class CrosswordCreator():
         # 以 minimum remaining value 选择一个未分配的变量
         var = self.select_unassigned_variable(assignment)
         # 以 least-constraining-value 选择一个值的列表
-        for value in self.order_domain_values(var, assignment):
+        for value in self.iter_domain_values(var, assignment):
             # 从最小的值开始，检查是否满足约束
-            new_assignment = assignment.copy()
-            new_assignment[var] = value
-            if self.consistent(new_assignment):
+            # (only `var` is new, so only its constraints can be broken)
+            if self._consistent_add(assignment, var, value):
+                assignment[var] = value
                 # 如果满足约束，继续递归,并更新 assignment 使其弧一致
-                arcs = [(var, n) for n in self.crossword.neighbors(var)]
+                self.trail.append([(var, self.domains[var] - {value})])
+                self.domains[var] = {value}
+                arcs = [(n, var) for n in self._neighbors[var]]
                 inference = self.ac3(arcs)
                 # 如果
                 if inference:
-                    result = self.backtrack(new_assignment)
-                    if result is not False:
+                    result = self.backtrack(assignment)
+                    if result is not None:
                         return result
-            # 如果不满足约束，删除这个值
-            del new_assignment[var]
+                # 推理失败，把这次推理删除的词放回 domains
+                for v, removed in reversed(self.trail.pop()):
+                    self.add_words(v, removed)
+                # 删除这个值
+                del assignment[var]
         return None
 
 def main():